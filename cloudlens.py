@@ -3,14 +3,20 @@
 @author Michael Wan
 
 Usage:
-cloudlens [-h] {start,shutdown,config,uninstall,status} ...
+cloudlens [-h] {start,shutdown,config,uninstall,status,top} ...
 cloudlens start [-h] [--yaml YAML] [--namespace NAMESPACE]
                 [--labels LABELS [LABELS ...]]
                 {webhook,testapp,deployment}
 cloudlens shutdown [-h] [--namespace NAMESPACE]
                    [--labels LABELS [LABELS ...]] [--all-namespaces]
                    {webhook,testapp,deployment} [name]
+cloudlens start webhook [--prepull] [--prepull-timeout PREPULL_TIMEOUT]
 cloudlens config [-h] --namespace NAMESPACE {key} apikey
+cloudlens config [-h] [--image IMAGE] [--digest DIGEST] {sidecar}
+cloudlens top [-h] [--metrics-file METRICS_FILE] [--pods-file PODS_FILE]
+              [--sort {cpu,memory}] [--cpu-request CPU_REQUEST]
+              [--cpu-limit CPU_LIMIT] [--memory-request MEMORY_REQUEST]
+              [--memory-limit MEMORY_LIMIT]
 
 
 Enables automatic Cloudlens sidecar agent injection, webhook deployment, and
@@ -19,14 +25,44 @@ easy Cloudlens API key configuration
 
 import os
 import re
+import time
 import argparse
 import subprocess
 import shlex
 import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
 import yaml
 
 DIR_NAME = "cloudlens-cli"
 WEBHOOK_NS = "default"
+SIDECAR_NAME = "webhook-injected-cloudlens-sidecar"
+PREPULL_NAME = "cloudlens-agent-prepull"
+PREPULL_TIMEOUT = 300
+DEFAULT_REGISTRY = "registry-1.docker.io"
+DOCKER_HUB_HOSTS = ["docker.io", "index.docker.io", DEFAULT_REGISTRY]
+MANIFEST_TYPES = ", ".join([
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+])
+DURATION_UNITS = {
+    "ns": 1e-9, "us": 1e-6, "\u00b5s": 1e-6, "ms": 1e-3, "s": 1, "m": 60,
+    "h": 3600,
+}
+POD_METRICS_API = "/apis/metrics.k8s.io/v1beta1/pods"
+QUANTITY_UNITS = {
+    "n": 1e-9, "u": 1e-6, "m": 1e-3, "": 1,
+    "k": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15, "E": 1e18,
+    "Ki": 2**10, "Mi": 2**20, "Gi": 2**30, "Ti": 2**40, "Pi": 2**50,
+    "Ei": 2**60,
+}
+QUANTITY_RE = re.compile(
+    r"^\+?([0-9]+(?:\.[0-9]*)?|\.[0-9]+)"
+    r"(?:[eE]([+-]?[0-9]+)|([KMGTPE]i|[numkMGTPE]))?$")
 
 
 def colorize(text, color="default"):
@@ -84,6 +120,17 @@ def cloudlens_cli_parser():
         help='specify namespace to start deployment')
     start_handler.add_argument(
         '--labels', dest='labels', nargs='+', help='specify custom labels')
+    start_handler.add_argument(
+        '--prepull',
+        dest='prepull',
+        action='store_true',
+        help='pre-pull the sidecar image on every node before enabling injection')
+    start_handler.add_argument(
+        '--prepull-timeout',
+        dest='prepull_timeout',
+        type=int,
+        default=PREPULL_TIMEOUT,
+        help='seconds to wait for the pre-pull (default %s)' % PREPULL_TIMEOUT)
 
     shutdown_handler = subparsers.add_parser('shutdown', help='shutdown help')
     shutdown_handler.add_argument(
@@ -102,12 +149,48 @@ def cloudlens_cli_parser():
 
     config_handler = subparsers.add_parser('config', help='config help')
     config_handler.add_argument(
-        'object', choices=['key'], help='object to be acted on')
+        'object', choices=['key', 'sidecar'], help='object to be acted on')
+    config_handler.add_argument(
+        'apikey', nargs='?', help='key value / file containing key')
+    config_handler.add_argument('--namespace', dest='namespace')
     config_handler.add_argument(
-        'apikey', help='key value / file containing key')
-    config_handler.add_argument('--namespace', dest='namespace', required=True)
+        '--image',
+        dest='image',
+        help='sidecar image to pin (defaults to the configured image)')
+    config_handler.add_argument(
+        '--digest',
+        dest='digest',
+        help='pin to this digest instead of resolving it from the registry')
     subparsers.add_parser('uninstall', help='uninstall help')
     subparsers.add_parser('status', help='status help')
+
+    top_handler = subparsers.add_parser('top', help='top help')
+    top_handler.add_argument(
+        '--metrics-file',
+        dest='metrics_file',
+        help='read pod metrics from a JSON file instead of the metrics API')
+    top_handler.add_argument(
+        '--pods-file',
+        dest='pods_file',
+        help='read pod list (kubectl get pods -o json) from a JSON file')
+    top_handler.add_argument(
+        '--sort',
+        dest='sort',
+        choices=['cpu', 'memory'],
+        default='cpu',
+        help='resource to sort by')
+    top_handler.add_argument(
+        '--cpu-request', dest='cpu_request', help='proposed sidecar CPU request')
+    top_handler.add_argument(
+        '--cpu-limit', dest='cpu_limit', help='proposed sidecar CPU limit')
+    top_handler.add_argument(
+        '--memory-request',
+        dest='memory_request',
+        help='proposed sidecar memory request')
+    top_handler.add_argument(
+        '--memory-limit',
+        dest='memory_limit',
+        help='proposed sidecar memory limit')
     return parser
 
 
@@ -129,6 +212,14 @@ def handle_parse_errors(args, parser):
                 colorize(
                     "Please specify a YAML file with the file flag to start an deployment.",
                     "error"))
+        if args.object != "webhook" and args.prepull:
+            parser.error(
+                colorize("Pre-pull can only be specified for webhook.",
+                         "error"))
+        if args.prepull_timeout <= 0:
+            parser.error(
+                colorize("Pre-pull timeout should be a positive number of seconds.",
+                         "error"))
     if args.action == "shutdown":
         if args.object == "deployment":
             if ("name" not in args or args.name is None) and ("labels" not in args or args.labels is None):
@@ -151,6 +242,37 @@ def handle_parse_errors(args, parser):
             parser.error(
                 colorize("Labels should not be specified for generic webhook or testapp.",
                     "error"))
+    if args.action == "config":
+        if args.object == "key" and (args.apikey is None or args.namespace is None):
+            parser.error(
+                colorize("Please specify both the key and the namespace.",
+                         "error"))
+        if args.object == "key" and (args.image or args.digest):
+            parser.error(
+                colorize("Image and digest should only be specified for sidecar.",
+                         "error"))
+        if args.object == "sidecar" and (args.apikey or args.namespace):
+            parser.error(
+                colorize("Key and namespace should not be specified for sidecar.",
+                         "error"))
+        if args.digest and not re.match(r"^sha256:[0-9a-f]{64}$", args.digest):
+            parser.error(
+                colorize("Digest should be of the form sha256:<64 hex digits>",
+                         "error"))
+    if args.action == "top":
+        quantities = [("cpu_request", parse_cpu), ("cpu_limit", parse_cpu),
+                      ("memory_request", parse_memory),
+                      ("memory_limit", parse_memory)]
+        for dest, parse in quantities:
+            value = getattr(args, dest)
+            if value is not None and parse(value) is None:
+                parser.error(
+                    colorize("Invalid quantity %s for --%s" %
+                             (value, dest.replace("_", "-")), "error"))
+        if args.pods_file and not args.metrics_file:
+            parser.error(
+                colorize("Pods file should only be specified with a metrics file.",
+                         "error"))
 
 
 def read_yaml(file):
@@ -380,7 +502,7 @@ def webhook_status():
     return True
 
 
-def create_webhook():
+def create_webhook(prepull=False, prepull_timeout=PREPULL_TIMEOUT):
     """Creates and deploys webhook in default namespace."""
     starting_ns = get_current_namespace()
     path_to_cur_dir = os.path.dirname(os.path.realpath(__file__))
@@ -399,12 +521,17 @@ def create_webhook():
         "kubectl create -f %s/deployment/configmap.yaml" % path_to_cur_dir,
         "kubectl create -f %s/deployment/deployment.yaml" % path_to_cur_dir,
         "kubectl create -f %s/deployment/service.yaml" % path_to_cur_dir,
-        "kubectl create -f %s/deployment/mutatingwebhook-ca-bundle.yaml" %
-        path_to_cur_dir
     ]
     cmds = [gen_cert_cmd, patch_cert_cmd]
     cmds.extend(apply_yamls)
     ret = all([bash(cmd, silent=True) for cmd in cmds])
+    if ret and prepull and not prepull_sidecar_image(prepull_timeout):
+        log("Warning. Enabling injection without a warm sidecar image.",
+            "warning")
+    ret = ret and bash(
+        "kubectl create -f %s/deployment/mutatingwebhook-ca-bundle.yaml" %
+        path_to_cur_dir,
+        silent=True)
     if WEBHOOK_NS != starting_ns:
         log("Switching back to namespace %s" % starting_ns, "warning")
         switch_namespace(starting_ns)
@@ -425,6 +552,7 @@ def remove_webhook():
         "kubectl delete service sidecar-injector-webhook-svc",
         "kubectl delete configmap --all",
         "kubectl delete mutatingwebhookconfiguration --all",
+        "kubectl delete daemonset %s --ignore-not-found" % PREPULL_NAME,
     ]
     ret = all([bash(cmd, silent=True) for cmd in cmds])
     if WEBHOOK_NS != starting_ns:
@@ -436,6 +564,350 @@ def remove_webhook():
         log("Error upon webhook deletion.", "error")
 
 
+def sidecar_configmap_path():
+    """Returns the path of the sidecar configmap shipped with the CLI"""
+    return os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "deployment/configmap.yaml")
+
+
+def read_sidecar_config():
+    """Reads the configmap and the injected sidecar container from it"""
+    configmap = read_yaml(sidecar_configmap_path())
+    if not configmap:
+        return None, None, None
+    sidecar_config = yaml.safe_load(configmap["data"]["sidecarconfig.yaml"])
+    for container in sidecar_config.get("containers", []):
+        if container.get("name") == SIDECAR_NAME:
+            return configmap, sidecar_config, container
+    log("Error. No %s container in sidecar config" % SIDECAR_NAME, "error")
+    return configmap, sidecar_config, None
+
+
+def write_sidecar_config(image, pull_policy):
+    """Rewrites only the sidecar image lines of the configmap file in place"""
+    with open(sidecar_configmap_path(), "r") as stream:
+        text = stream.read()
+    start = re.search(r"^(\s*)- name: %s\s*$" % re.escape(SIDECAR_NAME), text,
+                      re.M)
+    if not start:
+        raise ValueError("no %s container in sidecar config" % SIDECAR_NAME)
+    end = re.compile(r"^%s- " % start.group(1), re.M).search(text, start.end())
+    end = end.start() if end else len(text)
+    block = text[start.end():end]
+    block, found = re.subn(r"^(\s+)image:.*$", r"\g<1>image: %s" % image,
+                           block, count=1, flags=re.M)
+    if not found:
+        raise ValueError("no image set for %s" % SIDECAR_NAME)
+    block, found = re.subn(r"^(\s+)imagePullPolicy:.*$",
+                           r"\g<1>imagePullPolicy: %s" % pull_policy, block,
+                           count=1, flags=re.M)
+    if not found:
+        block = re.sub(r"^(\s+)image:.*$",
+                       r"\g<0>\n\g<1>imagePullPolicy: %s" % pull_policy,
+                       block, count=1, flags=re.M)
+    with open(sidecar_configmap_path(), "w") as stream:
+        stream.write(text[:start.end()] + block + text[end:])
+
+
+def split_image(image):
+    """Splits an image reference into registry, repository, name and tag"""
+    name = image.split("@")[0]
+    tag = "latest"
+    if ":" in name.rsplit("/", 1)[-1]:
+        name, tag = name.rsplit(":", 1)
+    parts = name.split("/", 1)
+    if len(parts) == 2 and ("." in parts[0] or ":" in parts[0]
+                            or parts[0] == "localhost"):
+        registry, repository = parts
+    else:
+        registry, repository = DEFAULT_REGISTRY, name
+    if registry in DOCKER_HUB_HOSTS:
+        registry = DEFAULT_REGISTRY
+        if "/" not in repository:
+            repository = "library/%s" % repository
+    return registry, repository, name, tag
+
+
+def registry_token(challenge):
+    """Fetches an anonymous bearer token for a registry auth challenge"""
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    realm = params.pop("realm")
+    url = "%s?%s" % (realm, urllib.parse.urlencode(params))
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        body = json.loads(resp.read().decode("utf-8"))
+    return body.get("token") or body.get("access_token")
+
+
+def resolve_image_digest(image):
+    """Resolves the digest an image tag currently points to in its registry"""
+    registry, repository, _, tag = split_image(image)
+    url = "https://%s/v2/%s/manifests/%s" % (registry, repository, tag)
+    headers = {"Accept": MANIFEST_TYPES}
+    try:
+        try:
+            req = urllib.request.Request(url, headers=headers, method="HEAD")
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                return resp.headers.get("Docker-Content-Digest")
+        except urllib.error.HTTPError as err:
+            challenge = err.headers.get("WWW-Authenticate", "")
+            if err.code != 401 or not challenge.startswith("Bearer"):
+                raise
+        headers["Authorization"] = "Bearer %s" % registry_token(challenge)
+        req = urllib.request.Request(url, headers=headers, method="HEAD")
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return resp.headers.get("Docker-Content-Digest")
+    except Exception as err:
+        log("*** Error ***", "error")
+        log("Could not resolve digest of %s: %s" % (image, str(err)), "error")
+        return None
+
+
+def pin_sidecar_image(image=None, digest=None, prepull_timeout=PREPULL_TIMEOUT):
+    """Pins the sidecar image by digest and stops pulling it on every start"""
+    _, _, container = read_sidecar_config()
+    if not container:
+        log("Error upon reading sidecar config.", "error")
+        return False
+    if image and "@" in image and not digest:
+        digest = image.split("@", 1)[1]
+        if not re.match(r"^sha256:[0-9a-f]{64}$", digest):
+            log("Error. Image digest should be of the form sha256:<64 hex digits>",
+                "error")
+            return False
+    image = image or container["image"]
+    _, _, name, tag = split_image(image)
+    if not digest:
+        log("Resolving digest of %s:%s..." % (name, tag), "warning")
+        digest = resolve_image_digest(image)
+        if not digest:
+            log("Error upon pinning sidecar image. Use --digest to pin manually.",
+                "error")
+            return False
+    pinned = "%s:%s@%s" % (name, tag, digest)
+    try:
+        write_sidecar_config(pinned, "IfNotPresent")
+    except Exception as err:
+        log("Error upon writing sidecar config %s" % str(err), "error")
+        return False
+    log("Pinned sidecar image to %s" % pinned, "success")
+    if bash(
+            "kubectl get daemonset %s --namespace %s" % (PREPULL_NAME, WEBHOOK_NS),
+            silent=True,
+            display_err=False) and not prepull_sidecar_image(prepull_timeout):
+        log("Warning. Switching injection without a warm sidecar image.",
+            "warning")
+    if bash(
+            "kubectl get configmap sidecar-injector-webhook-configmap --namespace %s"
+            % WEBHOOK_NS,
+            silent=True,
+            display_err=False):
+        log("Webhook running... updating its sidecar config", "warning")
+        cmds = [
+            "kubectl apply -f %s --namespace %s" %
+            (sidecar_configmap_path(), WEBHOOK_NS),
+            "kubectl rollout restart deployment \
+             sidecar-injector-webhook-deployment --namespace %s" % WEBHOOK_NS,
+        ]
+        if all([bash(cmd, silent=True) for cmd in cmds]):
+            log("Successfully updated webhook sidecar config.", "success")
+        else:
+            log("Error upon updating webhook sidecar config.", "error")
+            return False
+    return True
+
+
+def parse_time(timestamp):
+    """Parses a Kubernetes timestamp"""
+    return datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+
+
+def scheduled_time(pod):
+    """Returns when a pod was scheduled onto its node"""
+    for condition in pod.get("status", {}).get("conditions", []):
+        if condition.get("type") == "PodScheduled" and \
+                condition.get("status") == "True":
+            return parse_time(condition["lastTransitionTime"])
+    return None
+
+
+def container_start_delay(pod, name, init=False):
+    """Seconds between a pod being scheduled and the given container starting"""
+    scheduled = scheduled_time(pod)
+    key = "initContainerStatuses" if init else "containerStatuses"
+    for status in pod.get("status", {}).get(key, []):
+        if status.get("name") != name or scheduled is None:
+            continue
+        for state in ["running", "terminated"]:
+            started = status.get("state", {}).get(state, {}).get("startedAt")
+            if started:
+                return (parse_time(started) - scheduled).total_seconds()
+    return None
+
+
+def median(values):
+    """Returns the median of a non empty list"""
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def parse_duration(text):
+    """Converts a Go duration string such as 1m2.5s or 512ms to seconds"""
+    parts = re.findall(r"([0-9.]+)(ns|us|\u00b5s|ms|h|m|s)", text)
+    if not parts:
+        return None
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in parts)
+
+
+def get_pull_events():
+    """Gets all kubelet image pulled events in a single call"""
+    try:
+        ret = subprocess.check_output(
+            "kubectl get events --all-namespaces \
+             --field-selector reason=Pulled -o json",
+            shell=True)
+        return json.loads(ret.decode("utf-8"))
+    except Exception as err:
+        log("*** Error ***", "error")
+        log(str(err), "error")
+        return None
+
+
+def image_pull_time(message):
+    """Returns the seconds a kubelet pulled event reports for an image"""
+    if "already present on machine" in message:
+        return 0.0
+    match = re.search(r'Successfully pulled image "[^"]*" in (\S+)', message)
+    if not match:
+        return None
+    return parse_duration(match.group(1))
+
+
+def sidecar_pull_report(pods=None, events=None):
+    """Reports the sidecar image pull time of injected pods per pull policy"""
+    pods = pods or get_all_pods()
+    events = events or get_pull_events()
+    if not pods or not events:
+        return None
+    policies = {}
+    for pod in pods.get("items", []):
+        meta = pod.get("metadata", {})
+        for container in pod.get("spec", {}).get("containers", []):
+            if container.get("name") == SIDECAR_NAME:
+                policies[(meta.get("namespace"), meta.get("name"))] = \
+                    container.get("imagePullPolicy", "Always")
+    field_path = "spec.containers{%s}" % SIDECAR_NAME
+    pulls = {}
+    for event in events.get("items", []):
+        obj = event.get("involvedObject", {})
+        policy = policies.get((obj.get("namespace"), obj.get("name")))
+        if obj.get("fieldPath") != field_path or policy is None:
+            continue
+        pull_time = image_pull_time(event.get("message", ""))
+        if pull_time is not None:
+            pulls.setdefault(policy, []).append(pull_time)
+    if not pulls:
+        return None
+    log("Sidecar image pull time per pod start (from kubelet events):",
+        "success")
+    for policy, values in sorted(pulls.items()):
+        log("\t%s: median %.1fs over %s pod starts" %
+            (policy, median(values), len(values)), "info")
+    if "Always" in pulls and "IfNotPresent" in pulls:
+        saved = median(pulls["Always"]) - median(pulls["IfNotPresent"])
+        if saved > 0:
+            log("Pinned sidecar spends %.1fs less pulling its image per start" %
+                saved, "success")
+            return saved
+    return None
+
+
+def prepull_sidecar_image(timeout=PREPULL_TIMEOUT):
+    """Deploys a DaemonSet that warms the sidecar image on every node"""
+    _, _, container = read_sidecar_config()
+    if not container:
+        log("Error upon reading sidecar config.", "error")
+        return False
+    image = container["image"]
+    if "@" not in image or container.get("imagePullPolicy") == "Always":
+        log(
+            "Warning. Sidecar image is not pinned, injected pods will still \
+            contact the registry. Learn more by running 'cloudlens config -h'",
+            "warning")
+    path_to_cur_dir = os.path.dirname(os.path.realpath(__file__))
+    with open("%s/deployment/prepull-daemonset.yaml" % path_to_cur_dir) as stream:
+        yaml_content = stream.read().replace("${SIDECAR_IMAGE}", image)
+    cmd = "cat <<EOF | kubectl apply --namespace %s -f -\n" % WEBHOOK_NS + \
+          yaml_content + "\nEOF"
+    if not bash(cmd, keep_format=True, silent=True):
+        log("Error upon starting sidecar image pre-pull.", "error")
+        return False
+    log("Pre-pulling %s on all nodes..." % image, "warning")
+    deadline = time.time() + timeout
+    progress = None
+    while time.time() < deadline:
+        try:
+            ret = subprocess.check_output(
+                "kubectl get daemonset %s --namespace %s -o json" %
+                (PREPULL_NAME, WEBHOOK_NS),
+                shell=True)
+            daemonset = json.loads(ret.decode("utf-8"))
+            generation = daemonset.get("metadata", {}).get("generation", 0)
+            status = daemonset.get("status", {})
+        except Exception as err:
+            log("Error upon checking pre-pull progress, retrying: %s" %
+                str(err), "warning")
+            time.sleep(2)
+            continue
+        if status.get("observedGeneration", 0) < generation:
+            time.sleep(2)
+            continue
+        desired = status.get("desiredNumberScheduled", 0)
+        ready = min(status.get("numberReady", 0),
+                    status.get("updatedNumberScheduled", 0))
+        if (ready, desired) != progress:
+            progress = (ready, desired)
+            log("\tImage ready on %s/%s nodes" % (ready, desired), "info")
+        if desired and ready == desired:
+            break
+        time.sleep(2)
+    else:
+        log("Timed out after %ss waiting for pre-pull." % timeout, "error")
+        return False
+    log("Successfully pre-pulled sidecar image on %s nodes." % desired,
+        "success")
+    prepull_report()
+    return True
+
+
+def prepull_report():
+    """Reports how long the pre-pull took to warm the image on each node"""
+    try:
+        ret = subprocess.check_output(
+            "kubectl get pods -l app=%s --namespace %s -o json" %
+            (PREPULL_NAME, WEBHOOK_NS),
+            shell=True)
+        pods = json.loads(ret.decode("utf-8"))
+    except Exception as err:
+        log("*** Error ***", "error")
+        log(str(err), "error")
+        return
+    delays = []
+    for pod in pods.get("items", []):
+        delay = container_start_delay(pod, "prepull", init=True)
+        if delay is not None:
+            delays.append(delay)
+            log("\t%s: warm-up took %.1fs" %
+                (pod.get("spec", {}).get("nodeName"), delay), "info")
+    if delays:
+        log("Warm-up took %.1fs on the slowest node (median %.1fs). Nodes that \
+            already had the image report close to 0s." %
+            (max(delays), median(delays)), "success")
+    sidecar_pull_report()
+
+
 def start(file, labels=None, target_namespace=None):
     """Starts a deployment from a given file"""
     starting_ns = get_current_namespace()
@@ -526,6 +998,190 @@ def shutdown(name, labels=None, target_namespace=None, all_namespaces=False):
                     (",".join(labels), namespace), "success")
 
 
+def parse_quantity(quantity):
+    """Converts a Kubernetes quantity to its value in base units"""
+    match = QUANTITY_RE.match(str(quantity).strip())
+    if not match:
+        return None
+    number, exponent, suffix = match.groups()
+    if exponent is not None:
+        return float(number) * 10**int(exponent)
+    return float(number) * QUANTITY_UNITS[suffix or ""]
+
+
+def parse_cpu(quantity):
+    """Converts a Kubernetes CPU quantity to millicores"""
+    value = parse_quantity(quantity)
+    return None if value is None else value * 1000
+
+
+def parse_memory(quantity):
+    """Converts a Kubernetes memory quantity to MiB"""
+    value = parse_quantity(quantity)
+    return None if value is None else value / 2**20
+
+
+def read_json(file):
+    """Reads in a JSON file as specified by CLI"""
+    try:
+        with open(os.path.join(os.getcwd(), file), "r") as stream:
+            return json.load(stream)
+    except Exception as err:
+        log("Error upon reading %s" % file, "error")
+        log(str(err), "error")
+        return None
+
+
+def get_pod_metrics(metrics_file=None):
+    """Gets the metrics of all pods in a single call to the metrics API"""
+    if metrics_file:
+        return read_json(metrics_file)
+    try:
+        ret = subprocess.check_output(
+            "kubectl get --raw %s" % POD_METRICS_API,
+            shell=True,
+            stderr=subprocess.PIPE)
+        return json.loads(ret.decode("utf-8"))
+    except Exception as err:
+        log("*** Error ***", "error")
+        log("Could not query the metrics API. Is metrics-server installed?",
+            "error")
+        log(str(err), "error")
+        return None
+
+
+def get_all_pods(pods_file=None):
+    """Gets the spec and status of all pods in a single call"""
+    if pods_file:
+        return read_json(pods_file)
+    try:
+        ret = subprocess.check_output(
+            "kubectl get pods --all-namespaces -o json", shell=True)
+        return json.loads(ret.decode("utf-8"))
+    except Exception as err:
+        log("*** Error ***", "error")
+        log(str(err), "error")
+        return None
+
+
+def sidecar_usage(metrics, pods=None):
+    """Extracts the usage of every cloudlens sidecar from pod metrics"""
+    nodes = {}
+    for pod in (pods or {}).get("items", []):
+        meta = pod.get("metadata", {})
+        nodes[(meta.get("namespace"), meta.get("name"))] = \
+            pod.get("spec", {}).get("nodeName")
+    agents = []
+    for item in metrics.get("items", []):
+        meta = item.get("metadata", {})
+        for container in item.get("containers", []):
+            if container.get("name") != SIDECAR_NAME:
+                continue
+            usage = container.get("usage", {})
+            key = (meta.get("namespace"), meta.get("name"))
+            cpu = parse_cpu(usage.get("cpu"))
+            memory = parse_memory(usage.get("memory"))
+            if cpu is None or memory is None:
+                log("Skipping %s (%s): unparseable usage cpu=%s memory=%s" %
+                    (meta.get("name"), meta.get("namespace"),
+                     usage.get("cpu"), usage.get("memory")), "warning")
+                continue
+            agents.append({
+                "pod": meta.get("name"),
+                "namespace": meta.get("namespace"),
+                "node": nodes.get(key) or "<unknown>",
+                "cpu": cpu,
+                "memory": memory,
+            })
+    return agents
+
+
+def aggregate_usage(agents, group_by, sort_by="cpu"):
+    """Sums sidecar usage per group, sorted by overhead"""
+    groups = {}
+    for agent in agents:
+        group = groups.setdefault(agent[group_by], {
+            group_by: agent[group_by],
+            "agents": 0,
+            "cpu": 0.0,
+            "memory": 0.0
+        })
+        group["agents"] += 1
+        group["cpu"] += agent["cpu"]
+        group["memory"] += agent["memory"]
+    other = "memory" if sort_by == "cpu" else "cpu"
+    return sorted(
+        groups.values(),
+        key=lambda group: (group[sort_by], group[other]),
+        reverse=True)
+
+
+def check_profile(agents, profile):
+    """Flags agents whose usage exceeds a proposed request / limit profile"""
+    flagged = []
+    for agent in agents:
+        violations = []
+        for resource in ["cpu", "memory"]:
+            for bound in ["limit", "request"]:
+                value = profile.get("%s_%s" % (resource, bound))
+                if value is not None and agent[resource] > value:
+                    violations.append("%s %s" % (resource, bound))
+                    break
+        if violations:
+            flagged.append((agent, violations))
+    return flagged
+
+
+def top(metrics_file=None, pods_file=None, sort_by="cpu", profile=None):
+    """Shows aggregated resource usage of the injected cloudlens agents"""
+    metrics = get_pod_metrics(metrics_file)
+    if not isinstance(metrics, dict):
+        log("Error upon fetching pod metrics.", "error")
+        return False
+    pods = None
+    if pods_file or not metrics_file:
+        pods = get_all_pods(pods_file)
+        if not isinstance(pods, dict):
+            log("Error upon fetching pod list.", "error")
+            return False
+    agents = sidecar_usage(metrics, pods)
+    if not agents:
+        log("No cloudlens agents are reporting metrics at the moment.",
+            "success")
+        return True
+    log("%s cloudlens agents using %.0fm CPU and %.1fMi memory in total" %
+        (len(agents), sum(a["cpu"] for a in agents),
+         sum(a["memory"] for a in agents)), "success")
+    for group_by in ["namespace", "node"]:
+        log("")
+        log("%-40s %8s %10s %12s" % (group_by.upper(), "AGENTS", "CPU",
+                                     "MEMORY"), "info")
+        for group in aggregate_usage(agents, group_by, sort_by):
+            log("%-40s %8d %9.0fm %10.1fMi" %
+                (group[group_by], group["agents"], group["cpu"],
+                 group["memory"]))
+    profile = {
+        key: value
+        for key, value in (profile or {}).items() if value is not None
+    }
+    if not profile:
+        return True
+    log("")
+    flagged = check_profile(agents, profile)
+    if not flagged:
+        log("All agents fit within the proposed resource profile.", "success")
+        return True
+    log("%s agents exceed the proposed resource profile:" % len(flagged),
+        "warning")
+    flagged.sort(key=lambda pair: pair[0][sort_by], reverse=True)
+    for agent, violations in flagged:
+        color = "error" if any("limit" in v for v in violations) else "warning"
+        log("\t%s (%s) on %s: %.0fm CPU, %.1fMi memory - exceeds %s" %
+            (agent["pod"], agent["namespace"], agent["node"], agent["cpu"],
+             agent["memory"], ", ".join(violations)), color)
+    return True
+
+
 def uninstall_cli():
     """Uninstalls the CLI and its dependencies."""
     cmds = [
@@ -558,7 +1214,8 @@ def main():
     if args.action == "uninstall":
         uninstall_cli()
 
-    if not check_kubectl_installation():
+    offline = args.action == "top" and args.metrics_file
+    if not offline and not check_kubectl_installation():
         log(
             "Kubectl not installed. Please install by following \
             https://kubernetes.io/docs/tasks/tools/install-kubectl/", "error")
@@ -566,11 +1223,13 @@ def main():
 
     if args.action == "status":
         webhook_status()
-        pods_status()
+        if pods_status() > 0:
+            sidecar_pull_report()
     if args.action == "start":
         obj = args.object
         if obj == "webhook":
-            create_webhook()
+            create_webhook(
+                prepull=args.prepull, prepull_timeout=args.prepull_timeout)
         elif obj == "testapp":
             start(
                 os.path.join(
@@ -602,6 +1261,22 @@ def main():
             apikey = args.apikey
             namespace = args.namespace
             config_secret(apikey, namespace)
+        elif obj == "sidecar":
+            pin_sidecar_image(image=args.image, digest=args.digest)
+    elif args.action == "top":
+        top(metrics_file=args.metrics_file,
+            pods_file=args.pods_file,
+            sort_by=args.sort,
+            profile={
+                "cpu_request": parse_cpu(args.cpu_request)
+                               if args.cpu_request else None,
+                "cpu_limit": parse_cpu(args.cpu_limit)
+                             if args.cpu_limit else None,
+                "memory_request": parse_memory(args.memory_request)
+                                  if args.memory_request else None,
+                "memory_limit": parse_memory(args.memory_limit)
+                                if args.memory_limit else None,
+            })
 
 
 if __name__ == "__main__":